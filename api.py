@@ -4,19 +4,24 @@ Uses agent-framework for agent orchestration.
 """
 
 import os
+import sys
+import json
+import asyncio
 import logging
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from azure.identity import DefaultAzureCredential, DeviceCodeCredential, AzureCliCredential
-from azure.core.exceptions import ClientAuthenticationError
 
 from agent_framework.azure import AzureOpenAIChatClient
 from agent_framework import ChatAgent, ChatMessage, Role, TextContent
-from powerbi_client import PowerBIClient
+from powerbi_client import PowerBIClient, escape_dax_string, quote_column, quote_table
 
 # Configure logging to work with uvicorn
 import uvicorn.logging
@@ -31,25 +36,57 @@ logger.setLevel(logging.INFO)
 # Load environment variables
 load_dotenv()
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Server settings for `python api.py`
+# ─────────────────────────────────────────────────────────────────────────────
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "2"))
+_UVICORN_OPTIONS = dict(
+    host="0.0.0.0",
+    port=8000,
+    # uvloop is not available on Windows; fall back to the default asyncio loop there
+    loop="asyncio" if sys.platform == "win32" else "uvloop",
+    http="httptools",
+    log_level="warning",
+    access_log=False,
+)
+
+if __name__ == "__main__" and WORKERS > 1:
+    # Supervisor only: each worker imports `api` and runs the startup below itself,
+    # so hand off before authenticating or loading the schema in this process
+    uvicorn.run("api:app", workers=WORKERS, **_UVICORN_OPTIONS)
+    sys.exit()
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Authenticate at startup (like the notebook)
 # ─────────────────────────────────────────────────────────────────────────────
-logger.info("Authenticating to Power BI at startup...")
-try:
-    # Use AzureCliCredential directly (from az login)
-    _credential = AzureCliCredential()
-    _token = _credential.get_token("https://analysis.windows.net/powerbi/api/.default")
-    logger.info("✓ Authenticated using AzureCliCredential (az login)")
-except Exception as e:
-    logger.warning(f"AzureCliCredential failed: {e}")
+def _authenticate():
+    """Probe non-interactive credentials concurrently and return the first that yields a token."""
+    candidates = {
+        "AzureCliCredential (az login)": AzureCliCredential(),
+        "DefaultAzureCredential": DefaultAzureCredential(),
+    }
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = {pool.submit(cred.get_token, PowerBIClient.SCOPE): (name, cred) for name, cred in candidates.items()}
     try:
-        _credential = DefaultAzureCredential()
-        _token = _credential.get_token("https://analysis.windows.net/powerbi/api/.default")
-        logger.info("✓ Authenticated using DefaultAzureCredential")
-    except ClientAuthenticationError as e2:
-        logger.error(f"DefaultAzureCredential also failed: {e2}")
-        logger.info("Using DeviceCodeCredential - you will need to authenticate on first request")
-        _credential = DeviceCodeCredential()
+        for future in as_completed(futures):
+            name, credential = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f"{name} failed: {e}")
+                continue
+            logger.info(f"✓ Authenticated using {name}")
+            return credential
+    finally:
+        # Don't wait on the slower probe once one has succeeded
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    logger.info("Using DeviceCodeCredential - you will need to authenticate on first request")
+    return DeviceCodeCredential()
+
+
+logger.info("Authenticating to Power BI at startup...")
+_credential = _authenticate()
 
 # Create the Power BI client with the authenticated credential
 _pbi_client = PowerBIClient(_credential)
@@ -74,89 +111,190 @@ logger.info(f"Using dataset: {DATASET_NAME}")
 # Load schema once at startup
 logger.info("Loading dataset schema...")
 _schema = _pbi_client.describe_dataset(WORKSPACE_NAME, DATASET_NAME)
-DATASET_SCHEMA = _schema["llm_context"]
+_SCHEMA_OBJ = _schema
 logger.info(f"Schema loaded: {len(_schema.get('tables', []))} tables")
 
+# Immutable lookups built once from the schema so tool calls don't rescan it
+_TABLE_NAMES: tuple[str, ...] = tuple(t["name"] for t in _SCHEMA_OBJ.get("tables", []))
+_TEXT_COLS_BY_TABLE: dict[str, tuple[str, ...]] = {}
+for _table in _SCHEMA_OBJ.get("tables", []):
+    _text_cols = tuple(
+        name for name, data_type in zip(_table["col_names"], _table["data_types"])
+        if data_type.lower() in ("string", "text")
+    )
+    if _text_cols:
+        _TEXT_COLS_BY_TABLE[_table["name"]] = _text_cols
+
+# Compact table/column index for the system prompt; full column statistics are served by get_schema
+_TABLE_CONTEXTS = _schema.get("table_contexts", {})
+_index_lines = [
+    f"- '{t['name']}': {', '.join(t['col_names'])}"
+    for t in _SCHEMA_OBJ.get("tables", [])
+]
+if _schema.get("relationships"):
+    _index_lines.append("\nInferred relationships:")
+    _index_lines.extend(
+        f"- {rel['keyColumn']}: links {' <-> '.join(rel['tables'])}" for rel in _schema["relationships"]
+    )
+DATASET_INDEX = "\n".join(_index_lines)
+
+# Caps on what a single tool call returns to the LLM
+MAX_TOOL_ROWS = 50
+MAX_CELL_CHARS = 80
+
+# Limit concurrent searches so a wide model doesn't flood the endpoint
+_SEARCH_SEMAPHORE = asyncio.Semaphore(8)
+_SEARCH_BATCH_SIZE = 8  # tables combined into one UNION query
+
 # Initialize FastAPI
 app = FastAPI(title="Power BI Agent API")
 
-# CORS for Power BI visual
+# CORS for Power BI visual. Visuals run in a sandboxed iframe (origin "null") and send no
+# credentials, so any origin is allowed by default; a long max_age lets browsers cache the preflight.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=os.getenv("CORS_ORIGINS", "*").split(","),
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,
 )
 
+# Compress larger JSON replies; server-sent event streams are left uncompressed by the middleware
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+
+@app.on_event("shutdown")
+def close_pbi_client():
+    """Release pooled Power BI HTTP connections."""
+    _pbi_client.close()
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Tool Functions - These will be available to the agent
 # ─────────────────────────────────────────────────────────────────────────────
 
-def execute_dax(dax_query: str) -> str:
+def _truncate(value):
+    """Shorten long text cells to MAX_CELL_CHARS characters."""
+    if isinstance(value, str) and len(value) > MAX_CELL_CHARS:
+        return value[:MAX_CELL_CHARS] + "…"
+    return value
+
+
+def _format_df(df) -> str:
+    """Render a result DataFrame as compact CSV, truncated to MAX_TOOL_ROWS rows and MAX_CELL_CHARS per cell."""
+    text = df.head(MAX_TOOL_ROWS).map(_truncate).to_csv(index=False)
+    if len(df) > MAX_TOOL_ROWS:
+        text += f"… ({len(df) - MAX_TOOL_ROWS} more rows)"
+    return text
+
+
+async def execute_dax(dax_query: str) -> str:
     """Execute a DAX query against the semantic model and return results."""
     logger.info(f"TOOL CALLED: execute_dax()")
     logger.debug(f"DAX Query: {dax_query}")
     try:
-        df = _pbi_client.execute_dax(WORKSPACE_NAME, DATASET_NAME, dax_query)
+        df = await asyncio.to_thread(_pbi_client.execute_dax, WORKSPACE_NAME, DATASET_NAME, dax_query)
         if df.empty:
             logger.info("execute_dax returned no results")
             return "Query returned no results."
         logger.info(f"execute_dax returned {len(df)} rows")
-        return df.to_string(index=False)
+        return _format_df(df)
     except Exception as e:
         logger.error(f"execute_dax FAILED: {e}")
         logger.error(traceback.format_exc())
         return f"Error executing DAX: {str(e)}"
 
 
-def get_table_sample(table_name: str, num_rows: int = 5) -> str:
+async def get_table_sample(table_name: str, num_rows: int = 5) -> str:
     """Get sample rows from a table to understand its data content. Use this to see what values look like before writing complex queries."""
     logger.info(f"TOOL CALLED: get_table_sample(table='{table_name}', rows={num_rows})")
     try:
-        dax_query = f"EVALUATE TOPN({num_rows}, '{table_name}')"
-        df = _pbi_client.execute_dax(WORKSPACE_NAME, DATASET_NAME, dax_query)
+        dax_query = f"EVALUATE TOPN({int(num_rows)}, {quote_table(table_name)})"
+        df = await asyncio.to_thread(_pbi_client.execute_dax, WORKSPACE_NAME, DATASET_NAME, dax_query)
         if df.empty:
             return f"Table '{table_name}' is empty."
         logger.info(f"get_table_sample returned {len(df)} rows")
-        return df.to_string(index=False)
+        return _format_df(df)
     except Exception as e:
         logger.error(f"get_table_sample FAILED: {e}")
         logger.error(traceback.format_exc())
         return f"Error sampling table: {str(e)}"
 
 
-def search_across_tables(search_term: str) -> str:
-    """Search for a value across all text columns in all tables. Returns matching rows from any table containing the search term. Use this to find where specific names, IDs, or values exist in the model."""
+def get_schema(table_names: list[str]) -> str:
+    """Get column data types, cardinality and value ranges for the given tables. Call this before writing DAX against a table you haven't inspected yet."""
+    logger.info(f"TOOL CALLED: get_schema(tables={table_names})")
+    names = [name.strip("'") for name in table_names]
+    sections = [_TABLE_CONTEXTS[name] for name in names if name in _TABLE_CONTEXTS]
+    missing = [name for name in names if name not in _TABLE_CONTEXTS]
+    if missing:
+        sections.append(f"Unknown tables: {', '.join(missing)}. Available tables: {', '.join(_TABLE_NAMES)}")
+    return "\n\n".join(sections)
+
+
+_SEARCH_TERM = "{q}"  # placeholder substituted with the escaped search term
+
+
+def _search_template(table_name: str, text_columns: tuple[str, ...]) -> str:
+    """Build a (Table, Match) shaped table expression of at most MAX_TOOL_ROWS + 1 rows in one table containing _SEARCH_TERM."""
+    table = quote_table(table_name)
+    columns = [quote_column(col) for col in text_columns]
+    conditions = " || ".join([f'CONTAINSSTRING({col}, "{_SEARCH_TERM}")' for col in columns])
+    match = ' & " | " & '.join([f'"{escape_dax_string(name)}: " & {col}' for name, col in zip(text_columns, columns)])
+    rows = f"TOPN({MAX_TOOL_ROWS + 1}, FILTER({table}, {conditions}))"
+    return f'SELECTCOLUMNS({rows}, "Table", "{escape_dax_string(table_name)}", "Match", {match})'
+
+
+# Search expressions per table are built once; each call only substitutes the escaped search term
+_SEARCH_TEMPLATES = {t: _search_template(t, cols) for t, cols in _TEXT_COLS_BY_TABLE.items()}
+
+
+async def search_across_tables(search_term: str) -> str:
+    """Search for a value across all text columns in all tables. Returns the text values of matching rows from any table containing the search term. Use this to find where specific names, IDs, or values exist in the model."""
     logger.info(f"TOOL CALLED: search_across_tables(search='{search_term}')")
     try:
-        # Get schema to find all tables and text columns
-        schema = _pbi_client.describe_dataset(WORKSPACE_NAME, DATASET_NAME)
-        results = []
+        # Per-table expressions are precomputed from the schema loaded at startup
+        term = escape_dax_string(search_term)
+        expressions = {
+            table_name: template.replace(_SEARCH_TERM, term) for table_name, template in _SEARCH_TEMPLATES.items()
+        }
         
-        for table in schema.get("tables", []):
-            table_name = table["name"]
-            text_columns = [col["name"] for col in table.get("columns", []) 
-                          if col.get("dataType", "").lower() in ("string", "text")]
-            
-            if not text_columns:
-                continue
-            
-            # Build OR condition for all text columns
-            conditions = " || ".join([f'CONTAINSSTRING([{col}], "{search_term}")' for col in text_columns])
-            dax_query = f"EVALUATE FILTER('{table_name}', {conditions})"
-            
+        async def search_batch(table_names: list[str]) -> list:
+            # Equally-shaped per-table results are combined with UNION so a batch costs one round trip
+            parts = [expressions[t] for t in table_names]
+            dax_query = f"EVALUATE UNION({', '.join(parts)})" if len(parts) > 1 else f"EVALUATE {parts[0]}"
             try:
-                df = _pbi_client.execute_dax(WORKSPACE_NAME, DATASET_NAME, dax_query)
-                if not df.empty:
-                    results.append(f"=== {table_name} ({len(df)} matches) ===\n{df.to_string(index=False)}")
-            except Exception as table_error:
-                logger.warning(f"Search in {table_name} failed: {table_error}")
-                continue
+                # The Power BI client is synchronous, so run each query in a worker thread
+                async with _SEARCH_SEMAPHORE:
+                    return [await asyncio.to_thread(_pbi_client.execute_dax, WORKSPACE_NAME, DATASET_NAME, dax_query)]
+            except Exception as batch_error:
+                if len(table_names) == 1:
+                    logger.warning(f"Search in {table_names[0]} failed: {batch_error}")
+                    return []
+                # Retry tables individually so one bad table doesn't hide matches in the others
+                logger.warning(f"Batched search failed, retrying per table: {batch_error}")
+                retries = await asyncio.gather(*(search_batch([t]) for t in table_names))
+                return [df for frames in retries for df in frames]
+        
+        table_names = list(expressions)
+        batches = [table_names[i:i + _SEARCH_BATCH_SIZE] for i in range(0, len(table_names), _SEARCH_BATCH_SIZE)]
+        batch_frames = await asyncio.gather(*(search_batch(b) for b in batches))
+        
+        matches: dict[str, list[str]] = {}
+        for frames in batch_frames:
+            for df in frames:
+                for table_name, match in df.itertuples(index=False, name=None):
+                    matches.setdefault(table_name, []).append(_truncate(match))
         
-        if results:
-            return "\n\n".join(results)
+        if matches:
+            # Each table returns at most MAX_TOOL_ROWS + 1 rows; the extra one only means "there are more"
+            return "\n\n".join(
+                f"=== {table_name} ({len(rows)} matches) ===\n" + "\n".join(rows)
+                if len(rows) <= MAX_TOOL_ROWS else
+                f"=== {table_name} (more than {MAX_TOOL_ROWS} matches) ===\n" + "\n".join(rows[:MAX_TOOL_ROWS])
+                + "\n… (more rows not shown)"
+                for table_name, rows in matches.items()
+            )
         else:
             return f"No matches found for '{search_term}' in any table."
     except Exception as e:
@@ -177,18 +315,21 @@ llm_client = AzureOpenAIChatClient(
     deployment_name=os.getenv("AZURE_OPENAI_MODEL", "gpt-4o"),
 )
 
-# Create the agent with tools - schema is injected at startup
+# Create the agent with tools - only the table/column index is injected; column details come from get_schema.
+# The instructions are identical on every turn, so they form a stable prefix for Azure OpenAI prompt caching.
 AGENT_INSTRUCTIONS = f"""You are a Power BI analyst. Answer questions by querying the semantic model below. Be concise - give results, not explanations of your process.
 
-## DATASET SCHEMA
+## DATASET TABLES
 
-{DATASET_SCHEMA}
+Semantic model: {DATASET_NAME}. Each line lists a table and its columns.
+
+{DATASET_INDEX}
 
 ## RULES
 
 1. **ACT, DON'T ASK** - Never ask permission. Just query and answer.
 
-2. **USE EXACT NAMES** - Use ONLY the table/column names from the schema above. Never guess or invent names.
+2. **USE EXACT NAMES** - Use ONLY the table/column names from the list above. Never guess or invent names. Call get_schema for the tables you need when types or value ranges matter.
 
 3. **BE PERSISTENT** - If a query returns nothing, try other tables. Use search_across_tables for finding specific values. Keep going until you find the answer or exhaust all options.
 
@@ -196,6 +337,7 @@ AGENT_INSTRUCTIONS = f"""You are a Power BI analyst. Answer questions by queryin
 
 ## TOOLS
 
+- get_schema: Column types, cardinality and value ranges for specific tables
 - get_table_sample: Preview rows from a table to understand its data
 - search_across_tables: Find a value across all text columns (use for names, IDs, etc.)
 - execute_dax: Run DAX queries
@@ -210,7 +352,7 @@ agent = ChatAgent(
     name="PowerBIAgent",
     instructions=AGENT_INSTRUCTIONS,
     chat_client=llm_client,
-    tools=[execute_dax, get_table_sample, search_across_tables],
+    tools=[get_schema, execute_dax, get_table_sample, search_across_tables],
 )
 
 
@@ -242,13 +384,42 @@ async def health():
     return {"status": "ok"}
 
 
+def _build_messages(request: ChatRequest) -> list[ChatMessage]:
+    """Convert the request history and new message into agent chat messages."""
+    messages: list[ChatMessage] = []
+    
+    for msg in request.history:
+        if msg.role == "user":
+            messages.append(ChatMessage(role=Role.USER, contents=[TextContent(text=msg.content)]))
+        elif msg.role == "assistant":
+            messages.append(ChatMessage(role=Role.ASSISTANT, contents=[TextContent(text=msg.content)]))
+    
+    # Add the new user message
+    messages.append(ChatMessage(role=Role.USER, contents=[TextContent(text=request.message)]))
+    return messages
+
+
+async def _stream_reply(messages: list[ChatMessage]):
+    """Yield the agent's reply as server-sent events as it is generated."""
+    try:
+        async for update in agent.run_stream(messages=messages):
+            if update.text:
+                yield f"data: {json.dumps({'delta': update.text})}\n\n"
+        yield "data: [DONE]\n\n"
+    except Exception as e:
+        logger.error(f"CHAT STREAM FAILED: {e}")
+        logger.error(traceback.format_exc())
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, stream: bool = False):
     """
     Chat with the Power BI agent.
     
     Args:
         request: Contains the new message and optional conversation history
+        stream: If true, stream the reply as server-sent events instead of a single JSON body
         
     Returns:
         The agent's reply
@@ -259,19 +430,13 @@ async def chat(request: ChatRequest):
     
     try:
         # Build messages list from history
-        messages: list[ChatMessage] = []
-        
-        for msg in request.history:
-            if msg.role == "user":
-                messages.append(ChatMessage(role=Role.USER, contents=[TextContent(text=msg.content)]))
-            elif msg.role == "assistant":
-                messages.append(ChatMessage(role=Role.ASSISTANT, contents=[TextContent(text=msg.content)]))
-        
-        # Add the new user message
-        messages.append(ChatMessage(role=Role.USER, contents=[TextContent(text=request.message)]))
+        messages = _build_messages(request)
         
         logger.info(f"Running agent with {len(messages)} messages...")
         
+        if stream:
+            return StreamingResponse(_stream_reply(messages), media_type="text/event-stream")
+        
         # Run the agent with messages
         response = await agent.run(messages=messages)
         
@@ -295,5 +460,5 @@ async def chat(request: ChatRequest):
 # ─────────────────────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Single worker: serve the app built above instead of importing api.py a second time
+    uvicorn.run(app, **_UVICORN_OPTIONS)
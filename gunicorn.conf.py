@@ -0,0 +1,22 @@
+"""
+Gunicorn config for running the agent API across multiple cores.
+
+Usage: gunicorn -c gunicorn.conf.py api:app
+
+The app is not preloaded, so each worker imports api.py after forking and runs the
+startup block (authentication, workspace/dataset discovery, schema load) itself.
+That is intentional: every worker gets its own PowerBIClient connection pool and
+token cache instead of sharing sockets inherited from the master process.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+worker_connections = 1000
+keepalive = 30
+preload_app = False
+accesslog = None
+
@@ -4,9 +4,17 @@ from fastmcp import FastMCP
 from pydantic import Field
 from azure.identity import DefaultAzureCredential
 from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+import atexit
+from concurrent.futures import Future
+import functools
 import logging
+import threading
+import time
 
-from powerbi_client import PowerBIClient
+from powerbi_client import PowerBIClient, escape_dax_string, quote_column, quote_table
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,8 +22,22 @@ logger = logging.getLogger(__name__)
 # Initialize MCP server
 mcp = FastMCP(name="Power BI MCP Server")
 
-# Initialize Power BI client
-_client = None
+# Initialize Power BI client once at import so the first tool call doesn't pay for it
+try:
+    _client = PowerBIClient(DefaultAzureCredential())
+    logger.info("PowerBIClient initialized")
+except Exception:
+    logger.exception("Failed to initialize PowerBIClient")
+    raise
+atexit.register(_client.close)
+
+# Metadata rarely changes within a session, so cache it briefly
+_CACHE_TTL = 600  # seconds
+_CACHE_MAXSIZE = 128
+_cache: dict[tuple, tuple[float, object]] = {}
+_inflight: dict[tuple, Future] = {}  # calls currently being fetched, shared by concurrent callers
+_cache_generation = 0  # bumped by flush_cache so fetches started before a flush aren't stored
+_cache_lock = threading.Lock()
 
 
 class RequestIPLogger:
@@ -34,14 +56,62 @@ class RequestIPLogger:
         await self._app(scope, receive, send)
 
 
-def get_client() -> PowerBIClient:
-    """Get or create the Power BI client."""
-    global _client
-    if _client is None:
-        credential = DefaultAzureCredential()
-        _client = PowerBIClient(credential)
-        logger.info("PowerBIClient initialized")
-    return _client
+def ttl_cache(func):
+    """Cache a tool's result per arguments for _CACHE_TTL seconds.
+    
+    Concurrent calls with the same arguments share a single in-flight fetch instead of
+    each hitting the Power BI API.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Lists (e.g. table filters) aren't hashable; key on them as tuples
+        key = (func.__name__, *args, *((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(kwargs.items())))
+        now = time.monotonic()
+        with _cache_lock:
+            hit = _cache.get(key)
+            if hit and now - hit[0] < _CACHE_TTL:
+                return hit[1]
+            pending = _inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = _inflight[key] = Future()
+                generation = _cache_generation
+        if not leader:
+            return pending.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            with _cache_lock:
+                _inflight.pop(key, None)
+            pending.set_exception(e)
+            raise
+        with _cache_lock:
+            if generation == _cache_generation:
+                if key not in _cache and len(_cache) >= _CACHE_MAXSIZE:
+                    _cache.pop(next(iter(_cache)))
+                _cache[key] = (now, result)
+            _inflight.pop(key, None)
+        pending.set_result(result)
+        return result
+    return wrapper
+
+
+def _records(df, max_rows: int) -> list[dict]:
+    """Convert at most max_rows rows of a DataFrame to a list of dicts."""
+    return df.head(max_rows).to_dict(orient="records")
+
+
+@mcp.custom_route("/admin/flush_cache", methods=["POST"])
+async def flush_cache(request: Request) -> JSONResponse:
+    """Drop all cached metadata so the next tool call refetches it."""
+    global _cache_generation
+    with _cache_lock:
+        flushed = len(_cache)
+        _cache.clear()
+        _cache_generation += 1
+    _client.clear_describe_cache()
+    logger.info("Flushed %d cached entries", flushed)
+    return JSONResponse({"flushed": flushed})
 
 
 # =============================================================================
@@ -49,22 +119,24 @@ def get_client() -> PowerBIClient:
 # =============================================================================
 
 @mcp.tool
+@ttl_cache
 def list_workspaces() -> list[dict]:
     """List all Power BI workspaces accessible to the authenticated user."""
-    client = get_client()
-    df = client.list_workspaces()
-    return [
-        {"name": row["name"], "id": row["id"], "is_premium": row.get("isOnDedicatedCapacity", False)} 
-        for _, row in df.iterrows()
-    ]
+    df = _client.list_workspaces()
+    if df.empty:
+        return []
+    is_premium = df["isOnDedicatedCapacity"].eq(True) if "isOnDedicatedCapacity" in df else False
+    return df.assign(is_premium=is_premium)[["name", "id", "is_premium"]].to_dict(orient="records")
 
 
 @mcp.tool
+@ttl_cache
 def list_datasets(workspace_name: str = Field(description="Name of the Power BI workspace")) -> list[dict]:
     """List all semantic models (datasets) in a workspace."""
-    client = get_client()
-    df = client.list_datasets(workspace_name)
-    return [{"name": row["name"], "id": row["id"]} for _, row in df.iterrows()]
+    df = _client.list_datasets(workspace_name)
+    if df.empty:
+        return []
+    return df[["name", "id"]].to_dict(orient="records")
 
 
 @mcp.tool
@@ -72,38 +144,41 @@ def read_table(
     workspace_name: str = Field(description="Name of the Power BI workspace"),
     dataset_name: str = Field(description="Name of the semantic model"),
     table_name: str = Field(description="Name of the table to read"),
-    top_n: int = Field(default=100, description="Maximum rows to return")
+    top_n: int = Field(default=100, gt=0, description="Maximum rows to return")
 ) -> list[dict]:
     """Read data from a table in a semantic model."""
-    client = get_client()
-    df = client.read_table(workspace_name, dataset_name, table_name, top_n=top_n)
-    return df.to_dict(orient="records")
+    df = _client.read_table(workspace_name, dataset_name, table_name, top_n=top_n)
+    return _records(df, top_n)
 
 
 @mcp.tool
 def execute_dax_query(
     workspace_name: str = Field(description="Name of the Power BI workspace"),
     dataset_name: str = Field(description="Name of the semantic model"),
-    dax_query: str = Field(description="DAX query to execute (must start with EVALUATE)")
+    dax_query: str = Field(description="DAX query to execute (must start with EVALUATE)"),
+    max_rows: int = Field(default=500, gt=0, description="Maximum rows to return")
 ) -> list[dict]:
     """Execute a DAX query against a Power BI semantic model."""
-    client = get_client()
-    df = client.execute_dax(workspace_name, dataset_name, dax_query)
-    return df.to_dict(orient="records")
+    df = _client.execute_dax(workspace_name, dataset_name, dax_query)
+    return _records(df, max_rows)
 
 
 @mcp.tool
+@ttl_cache
 def describe_dataset(
     workspace_name: str = Field(description="Name of the Power BI workspace"),
-    dataset_name: str = Field(description="Name of the semantic model")
+    dataset_name: str = Field(description="Name of the semantic model"),
+    tables: list[str] | None = Field(default=None, description="Only describe these tables (default: all tables)"),
+    include_stats: bool = Field(
+        default=True, description="Include min/max/cardinality; set to false for a faster metadata-only listing on large models"
+    )
 ) -> dict:
     """Get complete schema information about a semantic model including all tables, columns, and relationships.
     
     Use this tool first to understand the data model before writing DAX queries.
     Returns table names, column names, data types, cardinality, and an LLM-friendly context string.
     """
-    client = get_client()
-    result = client.describe_dataset(workspace_name, dataset_name)
+    result = _client.describe_dataset(workspace_name, dataset_name, tables=tables, include_stats=include_stats)
     
     # Add usage hint
     result["usage_hint"] = (
@@ -122,16 +197,16 @@ def search_table(
     table_name: str = Field(description="Name of the table to search"),
     column_name: str = Field(description="Column to search in"),
     search_value: str = Field(description="Value to search for"),
-    max_rows: int = Field(default=100, description="Maximum rows to return")
+    max_rows: int = Field(default=100, gt=0, description="Maximum rows to return")
 ) -> list[dict]:
     """Search for rows in a table where a column contains a value."""
-    client = get_client()
+    table = quote_table(table_name)
     dax = f"""
 EVALUATE
-TOPN({max_rows}, FILTER('{table_name}', CONTAINSSTRING('{table_name}'[{column_name}], "{search_value}")))
+TOPN({int(max_rows)}, FILTER({table}, CONTAINSSTRING({table}{quote_column(column_name)}, "{escape_dax_string(search_value)}")))
 """
-    df = client.execute_dax(workspace_name, dataset_name, dax)
-    return df.to_dict(orient="records")
+    df = _client.execute_dax(workspace_name, dataset_name, dax)
+    return _records(df, max_rows)
 
 
 if __name__ == "__main__":
@@ -139,5 +214,8 @@ if __name__ == "__main__":
         transport="streamable-http",
         host="127.0.0.1",
         port=8000,
-        middleware=[Middleware(RequestIPLogger, logger=logger)],
+        middleware=[
+            Middleware(RequestIPLogger, logger=logger),
+            Middleware(GZipMiddleware, minimum_size=1024),
+        ],
     )
@@ -1,13 +1,120 @@
 """Power BI Client for interacting with semantic models via REST API."""
 
+import codecs
+import functools
+import itertools
+import re
+import time
+
+import ijson
+import numpy as np
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Characters that mark a string min value as date-like in describe_dataset
+_DATE_CHARS_RE = re.compile(r"[-/:]")
+# Python types of min values classified as "Number" (bool included, as isinstance(v, int) is true for it)
+_NUMBER_TYPES = (int, float, bool)
+# Column name suffixes that mark a likely relationship key in describe_dataset
+_KEY_SUFFIXES = (" Key", "_Key", " ID", "_ID", "_id")
+# Metadata-only column listing for describe_dataset(include_stats=False), shaped like COLUMNSTATISTICS()
+_COLUMNS_METADATA_DAX = (
+    'SELECTCOLUMNS(INFO.VIEW.COLUMNS(), "Table Name", [Table], "Column Name", [Name], "Data Type", [DataType])'
+)
+# INFO.VIEW.COLUMNS data types mapped onto the types describe_dataset infers from statistics
+_METADATA_TYPES = {
+    "Int64": "Number", "Double": "Number", "Decimal": "Number", "Boolean": "Number",
+    "DateTime": "DateTime", "String": "Text",
+}
+
+
+def _loads(content: bytes):
+    """Parse a JSON response body with orjson (executeQueries responses may start with a UTF-8 BOM)."""
+    return orjson.loads(content.removeprefix(codecs.BOM_UTF8))
+
+
+class _ChunkReader:
+    """Minimal file-like view over an iterator of byte chunks, for ijson."""
+    
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b""
+    
+    def read(self, size: int = -1) -> bytes:
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return b""
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _stream_rows(response: requests.Response):
+    """Incrementally parse the result rows of a streamed executeQueries response."""
+    # iter_content handles Content-Encoding; the BOM has to be dropped before ijson sees it
+    chunks = response.iter_content(chunk_size=64 * 1024)
+    first = next(chunks, b"").removeprefix(codecs.BOM_UTF8)
+    reader = _ChunkReader(itertools.chain([first], chunks))
+    return ijson.items(reader, "results.item.tables.item.rows.item", use_float=True)
+
+
+def escape_dax_string(value: str) -> str:
+    """Escape a value for use inside a DAX string literal ("...")."""
+    return value.replace('"', '""')
+
+
+def quote_table(name: str) -> str:
+    """Quote a table name as a DAX identifier: 'Name'."""
+    return "'" + name.replace("'", "''") + "'"
+
+
+def quote_column(name: str) -> str:
+    """Quote a column name as a DAX identifier: [Name]."""
+    return "[" + name.replace("]", "]]") + "]"
+
+
+@functools.lru_cache(maxsize=256)
+def _build_read_table_dax(table_name: str, top_n: int | None, columns: tuple[str, ...] | None) -> str:
+    """Build the DAX query for read_table with table and column names safely quoted."""
+    if top_n is not None and top_n < 0:
+        raise ValueError(f"top_n must be non-negative, got {top_n}")
+    table = quote_table(table_name)
+    if columns:
+        projections = ", ".join(f'"{escape_dax_string(c)}", {table}{quote_column(c)}' for c in columns)
+        table = f"SELECTCOLUMNS({table}, {projections})"
+    if top_n:
+        return f"EVALUATE TOPN({int(top_n)}, {table})"
+    return f"EVALUATE {table}"
+
+
+@functools.lru_cache(maxsize=256)
+def _build_measure_dax(measure: str, group_by: tuple[str, ...] | None) -> str:
+    """Build the DAX query for evaluate_measure; group_by entries are column references like 'Table'[Column]."""
+    if not measure or not measure.strip():
+        raise ValueError("measure must be a non-empty DAX expression")
+    if group_by:
+        return f"EVALUATE SUMMARIZECOLUMNS({', '.join(group_by)}, \"Result\", {measure})"
+    return f"EVALUATE ROW(\"Result\", {measure})"
 
 
 class PowerBIClient:
     """Client for interacting with Power BI semantic models via REST API."""
     
     BASE_URL = "https://api.powerbi.com/v1.0/myorg"
+    SCOPE = "https://analysis.windows.net/powerbi/api/.default"
+    TIMEOUT = (5, 120)  # (connect, read) seconds; DAX queries on large models can be slow
+    TOKEN_REFRESH_MARGIN = 300  # seconds before expiry to acquire a fresh token
+    STREAM_THRESHOLD = 8 * 1024 * 1024  # executeQueries bodies at least this large are parsed incrementally
+    # describe_dataset results are reused for DESCRIBE_TTL seconds. When the dataset list reports a
+    # modifiedDateTime, each reuse is revalidated against it; otherwise the entry is trusted for the full TTL.
+    DESCRIBE_TTL = 3600
+    DESCRIBE_CACHE_MAXSIZE = 32
     
     def __init__(self, credential):
         """
@@ -18,18 +125,66 @@ class PowerBIClient:
         """
         self.credential = credential
         self._workspaces_cache = None
+        self._datasets_cache: dict[str, dict[str, dict]] = {}  # workspace name -> dataset name -> dataset
+        self._tokens = {}  # scope -> (token, expires_on)
+        self._headers = None  # prebuilt request headers for the current token
+        self._headers_token = None
+        self._describe_cache = {}  # (workspace name, dataset name) -> (cached_at, modifiedDateTime, result)
+        self._describe_generation = 0  # bumped by clear_describe_cache so in-flight results aren't stored
+        
+        # Reuse TLS connections to api.powerbi.com across calls and retry throttled/transient failures.
+        # executeQueries is a read-only POST, so POST is safe to retry on 429/5xx: the service rejected
+        # the request before running it. Read timeouts are not retried (read=0): the query already ran
+        # for the full read timeout and would most likely time out again while loading the capacity.
+        retry = Retry(
+            total=3,
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET", "POST"],
+            raise_on_status=False,
+        )
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+    
+    def close(self):
+        """Close pooled HTTP connections."""
+        self._session.close()
+    
+    def clear_describe_cache(self):
+        """Forget cached describe_dataset results, including any still being computed."""
+        self._describe_generation += 1
+        self._describe_cache.clear()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _get_token(self, scope: str = SCOPE) -> str:
+        """Get an access token, reusing the cached one until it is close to expiry."""
+        cached = self._tokens.get(scope)
+        if cached and time.time() < cached[1] - self.TOKEN_REFRESH_MARGIN:
+            return cached[0]
+        token = self.credential.get_token(scope)
+        self._tokens[scope] = (token.token, token.expires_on)
+        return token.token
     
     def _get_headers(self):
-        """Get authorization headers for API requests."""
-        token = self.credential.get_token("https://analysis.windows.net/powerbi/api/.default")
-        return {
-            "Authorization": f"Bearer {token.token}",
-            "Content-Type": "application/json"
-        }
+        """Get authorization headers for API requests, rebuilt only when the token changes."""
+        token = self._get_token()
+        if token != self._headers_token:
+            self._headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
+            self._headers_token = token
+        return self._headers
     
     def list_workspaces(self) -> pd.DataFrame:
         """List all workspaces the user has access to."""
-        response = requests.get(f"{self.BASE_URL}/groups", headers=self._get_headers())
+        response = self._session.get(f"{self.BASE_URL}/groups", headers=self._get_headers(), timeout=self.TIMEOUT)
         response.raise_for_status()
         workspaces = response.json().get("value", [])
         self._workspaces_cache = {ws["name"]: ws for ws in workspaces}
@@ -55,72 +210,76 @@ class PowerBIClient:
         """List all datasets in a workspace."""
         workspace_id = self.get_workspace_id(workspace_name)
         url = f"{self.BASE_URL}/groups/{workspace_id}/datasets"
-        response = requests.get(url, headers=self._get_headers())
+        response = self._session.get(url, headers=self._get_headers(), timeout=self.TIMEOUT)
         response.raise_for_status()
-        return pd.DataFrame(response.json().get("value", []))
+        datasets = response.json().get("value", [])
+        self._datasets_cache[workspace_name] = {ds["name"]: ds for ds in datasets}
+        return pd.DataFrame(datasets)
     
     def get_dataset_id(self, workspace_name: str, dataset_name: str) -> str:
         """Get dataset ID by name."""
-        df = self.list_datasets(workspace_name)
-        match = df[df["name"] == dataset_name]
-        if match.empty:
-            raise ValueError(f"Dataset '{dataset_name}' not found in workspace '{workspace_name}'")
-        return match.iloc[0]["id"]
+        # Only refetch the dataset list when the name isn't already known
+        if dataset_name not in self._datasets_cache.get(workspace_name, {}):
+            self.list_datasets(workspace_name)
+        try:
+            return self._datasets_cache[workspace_name][dataset_name]["id"]
+        except KeyError:
+            raise ValueError(f"Dataset '{dataset_name}' not found in workspace '{workspace_name}'") from None
     
     def execute_dax(self, workspace_name: str, dataset_name: str, dax_query: str) -> pd.DataFrame:
         """Execute a DAX query and return results as DataFrame."""
         workspace_id = self.get_workspace_id(workspace_name)
         dataset_id = self.get_dataset_id(workspace_name, dataset_name)
-        
+        return self._execute_dax_by_ids(workspace_id, dataset_id, dax_query)
+    
+    def _execute_dax_by_ids(self, workspace_id: str, dataset_id: str, dax_query: str) -> pd.DataFrame:
+        """Execute a DAX query against already-resolved workspace and dataset IDs."""
         url = f"{self.BASE_URL}/groups/{workspace_id}/datasets/{dataset_id}/executeQueries"
         payload = {
             "queries": [{"query": dax_query}],
             "serializerSettings": {"includeNulls": True}
         }
         
-        response = requests.post(url, headers=self._get_headers(), json=payload)
+        response = self._session.post(
+            url, headers=self._get_headers(), data=orjson.dumps(payload), timeout=self.TIMEOUT, stream=True
+        )
         
-        if response.status_code != 200:
-            error = response.json().get("error", {})
-            raise RuntimeError(f"DAX query failed: {error.get('message', response.text)}")
+        with response:
+            if response.status_code != 200:
+                error = _loads(response.content).get("error", {})
+                raise RuntimeError(f"DAX query failed: {error.get('message', response.text)}")
+            
+            # Small bodies are parsed in one go; large or chunked ones are streamed row by row
+            # so the raw bytes and the parsed document aren't both held in memory
+            length = int(response.headers.get("Content-Length") or 0)
+            if 0 < length < self.STREAM_THRESHOLD:
+                result = _loads(response.content)
+                tables = result.get("results", [{}])[0].get("tables", [])
+                rows = tables[0].get("rows", []) if tables else []
+            else:
+                rows = list(_stream_rows(response))
         
-        result = response.json()
-        tables = result.get("results", [{}])[0].get("tables", [])
-        if tables:
-            rows = tables[0].get("rows", [])
-            return pd.DataFrame(rows)
+        if rows:
+            # includeNulls gives every row the same keys, so take columns from the first row instead of inferring them
+            df = pd.DataFrame.from_records(rows, columns=list(rows[0].keys()))
+            # Arrow-backed columns keep strings contiguous and run .str operations on Arrow kernels
+            return df.convert_dtypes(dtype_backend="pyarrow")
         return pd.DataFrame()
     
     def read_table(self, workspace_name: str, dataset_name: str, table_name: str, 
                    top_n: int = None, columns: list = None) -> pd.DataFrame:
-        """Read data from a table in a semantic model."""
-        col_list = ", ".join(columns) if columns else "*"
-        
-        if top_n:
-            dax = f"EVALUATE TOPN({top_n}, '{table_name}')"
-        else:
-            dax = f"EVALUATE '{table_name}'"
-        
+        """Read data from a table in a semantic model, optionally limited to the given columns."""
+        dax = _build_read_table_dax(table_name, top_n, tuple(columns) if columns else None)
         return self.execute_dax(workspace_name, dataset_name, dax)
     
     def evaluate_measure(self, workspace_name: str, dataset_name: str, 
                          measure: str, group_by: list = None) -> pd.DataFrame:
         """Evaluate a measure, optionally grouped by columns."""
-        if group_by:
-            cols = ", ".join(group_by)
-            dax = f"""
-            EVALUATE 
-            SUMMARIZECOLUMNS(
-                {cols},
-                "Result", {measure}
-            )
-            """
-        else:
-            dax = f"EVALUATE ROW(\"Result\", {measure})"
-        
+        dax = _build_measure_dax(measure, tuple(group_by) if group_by else None)
         return self.execute_dax(workspace_name, dataset_name, dax)
     
-    def describe_dataset(self, workspace_name: str, dataset_name: str) -> dict:
+    def describe_dataset(self, workspace_name: str, dataset_name: str,
+                         tables: list[str] = None, include_stats: bool = True) -> dict:
         """
         Get complete schema information about a semantic model for LLM consumption.
         
@@ -129,97 +288,135 @@ class PowerBIClient:
         Args:
             workspace_name: Name of the Power BI workspace
             dataset_name: Name of the semantic model/dataset
+            tables: Only describe these tables (default: all tables)
+            include_stats: Compute min/max/cardinality via COLUMNSTATISTICS; if False, read column
+                metadata only, which avoids scanning (and paging in) column data on large models
             
         Returns:
-            dict with keys: dataset_name, dataset_id, tables, relationships, llm_context
+            dict with keys: dataset_name, dataset_id, tables, relationships, table_contexts, llm_context.
+            Each entry in tables is columnar: name plus parallel lists col_names, data_types,
+            min_values, max_values and cardinalities.
         """
+        # Resolve IDs once and reuse them for the query below
+        workspace_id = self.get_workspace_id(workspace_name)
+        key = (workspace_name, dataset_name, tuple(tables) if tables else None, include_stats)
+        cached = self._describe_cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.DESCRIBE_TTL:
+            if cached[1] is None:
+                # No modification time to revalidate against: plain TTL
+                return dict(cached[2])
+            # Refresh the dataset list (one GET) to revalidate against the dataset's modification time
+            self.list_datasets(workspace_name)
+            dataset = self._datasets_cache[workspace_name].get(dataset_name)
+            if dataset and dataset.get("modifiedDateTime") == cached[1]:
+                return dict(cached[2])
         dataset_id = self.get_dataset_id(workspace_name, dataset_name)
+        modified = self._datasets_cache[workspace_name][dataset_name].get("modifiedDateTime")
+        generation = self._describe_generation
         
         # 1. Get column statistics (table names, column names, min/max values, cardinality)
-        schema_dax = "EVALUATE COLUMNSTATISTICS()"
-        df_schema = self.execute_dax(workspace_name, dataset_name, schema_dax)
+        source = "COLUMNSTATISTICS()" if include_stats else _COLUMNS_METADATA_DAX
+        if tables:
+            names = ", ".join(f'"{escape_dax_string(t)}"' for t in tables)
+            source = f"FILTER({source}, [Table Name] IN {{{names}}})"
+        df_schema = self._execute_dax_by_ids(workspace_id, dataset_id, f"EVALUATE {source}")
         
-        # 2. Build the schema dictionary from COLUMNSTATISTICS results
-        tables_dict = {}
-        for _, row in df_schema.iterrows():
-            table_name = row.get("[Table Name]") or row.get("Table Name")
-            col_name = row.get("[Column Name]") or row.get("Column Name")
+        # 2. Build the schema from COLUMNSTATISTICS results with vectorized column operations
+        table_entries = []
+        relationships = []
+        table_contexts = {}  # per-table markdown sections, also returned so callers can send only the tables they need
+        if not df_schema.empty:
+            # Column names come back as "[Table Name]"; normalize once instead of probing both forms per row
+            df_schema.columns = df_schema.columns.str.strip("[]")
+            if not include_stats:
+                df_schema = df_schema.assign(Min=None, Max=None, Cardinality=None)
+            df_schema["Cardinality"] = pd.to_numeric(df_schema["Cardinality"], errors="coerce").astype("Int64")
             
             # Skip auto-generated date tables and internal RowNumber columns
-            if table_name and ("DateTableTemplate" in table_name or "LocalDateTable" in table_name):
-                continue
-            if col_name and "RowNumber-" in col_name:
-                continue
+            keep = ~df_schema["Table Name"].str.contains("DateTableTemplate|LocalDateTable", na=False) & \
+                ~df_schema["Column Name"].str.contains("RowNumber-", regex=False, na=False)
+            df = df_schema[keep]
+            # Group rows by table (in order of first appearance) so later groupbys see columns table by table
+            df = df.iloc[np.argsort(pd.factorize(df["Table Name"])[0], kind="stable")]
             
-            if table_name not in tables_dict:
-                tables_dict[table_name] = {"name": table_name, "columns": []}
+            if not include_stats:
+                # Metadata-only listing: take the declared data type instead of inferring it
+                data_types = df["Data Type"].map(_METADATA_TYPES).fillna("Unknown").to_numpy()
+            else:
+                # Infer data type from min values: numbers, date-like strings, other text
+                # One Python-level pass over the raw values (Series.map on an Arrow column would turn NA into NaN);
+                # the masks are then plain vectorized comparisons
+                mins = df["Min"]
+                if pd.api.types.is_numeric_dtype(mins):
+                    # Typed numeric column (e.g. every min is a number): no per-value work needed
+                    is_num = mins.notna()
+                    is_str = is_date = pd.Series(False, index=mins.index)
+                else:
+                    # Arrow-typed columns (bool, null, ...) cannot hold "" for non-strings, so work on an object copy;
+                    # dtype=object stops pandas re-inferring a str dtype (and NaN nulls) from all-string values
+                    values = pd.Series(mins.to_numpy(dtype=object), index=mins.index, dtype=object)
+                    # Not values.map(type): Series.map passes pd.NA through as NaN, which would count as a number
+                    min_types = pd.Series(list(map(type, values)), index=values.index)
+                    is_num = min_types.isin(_NUMBER_TYPES)
+                    is_str = min_types.eq(str)
+                    str_mins = values.where(is_str, "").astype(str)
+                    is_date = is_str & str_mins.str.contains(_DATE_CHARS_RE) & str_mins.str.len().ge(8)
+                data_types = np.select([is_num, is_date, is_str], ["Number", "DateTime", "Text"], default="Unknown")
             
-            # Extract all available column metadata
-            min_val = row.get("[Min]") or row.get("Min")
-            max_val = row.get("[Max]") or row.get("Max")
-            cardinality = row.get("[Cardinality]") or row.get("Cardinality")
+            stats = df[["Min", "Max", "Cardinality"]].astype(object)
+            columns = pd.DataFrame({
+                "name": df["Column Name"],
+                "dataType": data_types,
+                "minValue": stats["Min"].where(stats["Min"].notna(), None),
+                "maxValue": stats["Max"].where(stats["Max"].notna(), None),
+                "cardinality": stats["Cardinality"].where(stats["Cardinality"].notna(), None),
+            }, index=df.index)
             
-            # Infer data type from min/max values
-            data_type = "Unknown"
-            if min_val is not None:
-                if isinstance(min_val, (int, float)):
-                    data_type = "Number"
-                elif isinstance(min_val, str):
-                    # Check if it looks like a date
-                    if any(c in str(min_val) for c in ["-", "/", ":"]) and len(str(min_val)) >= 8:
-                        data_type = "DateTime"
-                    else:
-                        data_type = "Text"
+            # One list per attribute per table (no per-column dicts); lists line up by position
+            table_entries = [
+                {
+                    "name": table_name,
+                    "col_names": group["name"].tolist(),
+                    "data_types": group["dataType"].tolist(),
+                    "min_values": group["minValue"].tolist(),
+                    "max_values": group["maxValue"].tolist(),
+                    "cardinalities": group["cardinality"].tolist(),
+                }
+                for table_name, group in columns.groupby(df["Table Name"], sort=False)
+            ]
             
-            tables_dict[table_name]["columns"].append({
-                "name": col_name,
-                "dataType": data_type,
-                "minValue": min_val,
-                "maxValue": max_val,
-                "cardinality": cardinality,
-            })
-        
-        tables = list(tables_dict.values())
-        
-        # 3. Get relationships by examining key columns (columns ending in Key, ID, etc.)
-        relationships = []
-        key_columns = {}
-        for table in tables:
-            for col in table["columns"]:
-                col_name = col["name"]
-                if col_name and (col_name.endswith(" Key") or col_name.endswith("_Key") or 
-                               col_name.endswith(" ID") or col_name.endswith("_ID") or
-                               col_name.endswith("_id") or col_name == "ID"):
-                    key_columns.setdefault(col_name, []).append(table["name"])
-        
-        # Infer relationships from matching key columns across tables
-        for key_name, table_list in key_columns.items():
-            if len(table_list) > 1:
-                relationships.append({
-                    "keyColumn": key_name,
-                    "tables": table_list
-                })
+            # Markdown rows for the LLM context, built column-wise rather than per column dict
+            has_range = columns["minValue"].map(bool) & columns["maxValue"].map(bool)
+            sample = (columns["minValue"].astype(str) + " to " + columns["maxValue"].astype(str)).where(has_range, "N/A")
+            md_rows = "| " + columns["name"].astype(str) + " | " + columns["dataType"] + " | " + \
+                columns["cardinality"].map(str) + " | " + sample + " |"
+            md_header = "| Column | Type | Cardinality | Sample Range |\n|---|---|---|---|"
+            table_contexts = {
+                table_name: f"### '{table_name}'\n{md_header}\n" + "\n".join(rows)
+                for table_name, rows in md_rows.groupby(df["Table Name"], sort=False)
+            }
+            
+            # 3. Infer relationships from key columns (ending in Key, ID, etc.) that appear in multiple tables
+            col_names = df["Column Name"]
+            is_key = col_names.str.endswith(_KEY_SUFFIXES, na=False) | col_names.eq("ID")
+            tables_by_key = df[is_key].groupby("Column Name", sort=False)["Table Name"].agg(list)
+            relationships = [
+                {"keyColumn": key_name, "tables": table_list}
+                for key_name, table_list in tables_by_key.items()
+                if len(table_list) > 1
+            ]
         
         # 4. Generate LLM-friendly context string
         llm_lines = [
             f"# Power BI Semantic Model: {dataset_name}",
             "",
             "## Overview",
-            f"This model contains {len(tables)} tables that can be queried using DAX.",
+            f"This model contains {len(table_entries)} tables that can be queried using DAX.",
             "",
             "## Tables and Columns"
         ]
         
-        for table in tables:
-            llm_lines.append(f"\n### '{table['name']}'")
-            llm_lines.append("| Column | Type | Cardinality | Sample Range |")
-            llm_lines.append("|--------|------|-------------|--------------|")
-            for col in table["columns"]:
-                card = col.get('cardinality', 'N/A')
-                min_v = col.get('minValue', '')
-                max_v = col.get('maxValue', '')
-                sample = f"{min_v} to {max_v}" if min_v and max_v else "N/A"
-                llm_lines.append(f"| {col['name']} | {col.get('dataType', 'Unknown')} | {card} | {sample} |")
+        llm_lines.extend("\n" + context for context in table_contexts.values())
         
         if relationships:
             llm_lines.append("\n## Inferred Relationships")
@@ -239,10 +436,16 @@ class PowerBIClient:
         
         llm_context = "\n".join(llm_lines)
         
-        return {
+        result = {
             "dataset_name": dataset_name,
             "dataset_id": dataset_id,
-            "tables": tables,
+            "tables": table_entries,
             "relationships": relationships,
+            "table_contexts": table_contexts,
             "llm_context": llm_context
         }
+        if generation == self._describe_generation:
+            if key not in self._describe_cache and len(self._describe_cache) >= self.DESCRIBE_CACHE_MAXSIZE:
+                self._describe_cache.pop(next(iter(self._describe_cache)))
+            self._describe_cache[key] = (time.monotonic(), modified, result)
+        return dict(result)
@@ -0,0 +1,65 @@
+"""Tests for PowerBIClient.describe_dataset against canned executeQueries responses."""
+
+import time
+from types import SimpleNamespace
+
+import orjson
+import pytest
+import requests
+
+from powerbi_client import PowerBIClient
+
+
+class FakeCredential:
+    def get_token(self, scope):
+        return SimpleNamespace(token="token", expires_on=time.time() + 3600)
+
+
+def _response(body: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = orjson.dumps(body)
+    response.headers["Content-Length"] = str(len(response._content))
+    return response
+
+
+class FakeSession:
+    """Serves the workspace/dataset lists and one COLUMNSTATISTICS result."""
+
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+
+    def get(self, url, **kwargs):
+        if url.endswith("/groups"):
+            return _response({"value": [{"name": "WS", "id": "ws-1"}]})
+        return _response({"value": [{"name": "Model", "id": "ds-1"}]})
+
+    def post(self, url, **kwargs):
+        return _response({"results": [{"tables": [{"rows": self.rows}]}]})
+
+    def close(self):
+        pass
+
+
+def _describe(mins: list) -> list[str]:
+    rows = [
+        {"[Table Name]": "T", "[Column Name]": f"c{i}", "[Min]": m, "[Max]": m, "[Cardinality]": 1}
+        for i, m in enumerate(mins)
+    ]
+    client = PowerBIClient(FakeCredential())
+    client._session = FakeSession(rows)
+    result = client.describe_dataset("WS", "Model")
+    return result["tables"][0]["data_types"]
+
+
+@pytest.mark.parametrize("mins, expected", [
+    ([None, None], ["Unknown", "Unknown"]),
+    ([True, False], ["Number", "Number"]),
+    ([1, 2, None], ["Number", "Number", "Unknown"]),
+    ([1.5, 2.5], ["Number", "Number"]),
+    ([1, "2020-01-01", "abc", None], ["Number", "DateTime", "Text", "Unknown"]),
+    (["abc", "2020-01-01T00:00:00", None, "12/31"], ["Text", "DateTime", "Unknown", "Text"]),
+])
+def test_describe_dataset_infers_types_for_any_min_dtype(mins, expected):
+    # Arrow-backed Min columns come back as null, bool, numeric or string dtypes depending on the values
+    assert _describe(mins) == expected